@@ -1,6 +1,17 @@
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 
-app = FastAPI(title="OpenAI Stream Mocker")
+app = FastAPI(
+    title="OpenAI Stream Mocker",
+    description="A service that mocks OpenAI streaming responses for testing",
+    version="1.0.0",
+    default_response_class=ORJSONResponse
+)
 
-from app.api import router as api_router
+from app.api import router as api_router, CORSHeadersMiddleware
+
+# Add CORS headers to all responses and answer preflight requests
+app.add_middleware(CORSHeadersMiddleware)
+
+# Include the API router
 app.include_router(api_router)
@@ -1,39 +1,76 @@
+import itertools
 import time
-from typing import Dict, Any
+from typing import Dict, Any, Optional, Tuple
 
-from fastapi import APIRouter, Request, HTTPException, Depends, Header
+import orjson
+from fastapi import APIRouter, Request, Response, HTTPException, Depends, Header
 from fastapi.responses import StreamingResponse
-from fastapi.middleware.cors import CORSMiddleware
-from starlette.responses import JSONResponse
 
 from app.models import CompletionRequest, ModelConfig
 from app.services import stream_response, get_response_content, get_response_content_for_duration
 from app.utils import calculate_usage, estimate_speed_from_parameters
-from app.config import MODEL_CONFIGS, DEFAULT_CONFIG, SAMPLE_RESPONSES, reload_config
+import app.config as app_config
+from app.config import (
+    MODEL_CONFIGS, SAMPLE_RESPONSES, reload_config, get_auto_response_length,
+    set_time_limit, set_enforce_time_limit, set_default_config, bump_config_version
+)
 
 router = APIRouter()
 
-# Function to add CORS middleware to the app
-def add_cors_middleware(app):
-    """Add CORS middleware to the application"""
-    app.add_middleware(
-        CORSMiddleware,
-        allow_origins=["*"],  # Allow all origins
-        allow_credentials=True,
-        allow_methods=["*"],  # Allow all methods
-        allow_headers=["*"],  # Allow all headers
-    )
-
-# Function to add CORS headers to all responses
-def add_cors_headers_middleware(app):
-    """Add middleware to add CORS headers to all responses"""
-    @app.middleware("http")
-    async def add_cors_headers(request, call_next):
-        response = await call_next(request)
-        response.headers["Access-Control-Allow-Origin"] = "*"
-        response.headers["Access-Control-Allow-Methods"] = "GET, POST, PUT, DELETE, OPTIONS"
-        response.headers["Access-Control-Allow-Headers"] = "Authorization, Content-Type"
-        return response
+# CORS headers, built once at import time
+_CORS_HEADERS = (
+    (b"access-control-allow-origin", b"*"),
+    (b"access-control-allow-methods", b"GET, POST, PUT, DELETE, OPTIONS"),
+    (b"access-control-allow-headers", b"Authorization, Content-Type"),
+)
+# Preflight responses also let browsers cache the result for 24 hours
+_CORS_PREFLIGHT_HEADERS = _CORS_HEADERS + ((b"access-control-max-age", b"86400"),)
+
+# Keep reverse proxies (e.g. nginx) from buffering or caching the event stream.
+# The content type is set here rather than through media_type, which would make
+# Starlette append "; charset=utf-8"; the streaming test expects exactly
+# "text/event-stream"
+_STREAM_HEADERS = {
+    "Content-Type": "text/event-stream",
+    "X-Accel-Buffering": "no",
+    "Cache-Control": "no-cache",
+}
+
+# Completion ids: a per-process prefix plus a monotonically increasing counter
+_COMPLETION_ID_PREFIX = f"mock-completion-{int(time.time())}-"
+_COMPLETION_ID_COUNTER = itertools.count(1)
+
+# Serialized response bodies, stored as (config version, JSON bytes)
+_MODELS_CACHE: Optional[Tuple[int, bytes]] = None
+_CONFIG_CACHE: Optional[Tuple[int, bytes]] = None
+# Precomputed /responses payload, stored as (config version, response options)
+_RESPONSE_OPTIONS_CACHE: Optional[Tuple[int, Dict[str, Any]]] = None
+
+# Pure ASGI middleware that adds CORS headers to all responses
+class CORSHeadersMiddleware:
+    """Append CORS headers to every HTTP response without buffering the body"""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # Answer CORS preflight requests before they reach the router
+        if scope["method"] == "OPTIONS":
+            await send({"type": "http.response.start", "status": 204, "headers": _CORS_PREFLIGHT_HEADERS})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.extend(_CORS_HEADERS)
+                message["headers"] = headers
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
 
 # Add a dependency to ensure configuration is loaded
 async def ensure_config_loaded():
@@ -53,26 +90,41 @@ async def ignore_api_key(authorization: str = Header(None)):
     # This function always passes, effectively removing API key restrictions
     return True
 
-@router.options("/{rest_of_path:path}")
-async def options_handler(rest_of_path: str):
-    # Handle OPTIONS requests for CORS preflight
-    response = JSONResponse(content={})
-    response.headers["Access-Control-Allow-Origin"] = "*"
-    response.headers["Access-Control-Allow-Methods"] = "GET, POST, PUT, DELETE, OPTIONS"
-    response.headers["Access-Control-Allow-Headers"] = "Authorization, Content-Type"
-    return response
-
 @router.get("/", dependencies=[Depends(ensure_config_loaded), Depends(ignore_api_key)])
-def read_root():
+async def read_root():
     return {"message": "OpenAI Stream Mocker", "version": "1.0.0"}
 
-@router.options("/v1/chat/completions")
-def get_options():
-    response = JSONResponse(content={})
-    response.headers["Access-Control-Allow-Origin"] = "*"
-    response.headers["Access-Control-Allow-Methods"] = "GET, POST, PUT, DELETE, OPTIONS"
-    response.headers["Access-Control-Allow-Headers"] = "Authorization, Content-Type"
-    return response
+def _content_for_length(response_length: str, model_config: ModelConfig) -> str:
+    """Get response content for an explicitly requested length"""
+    return get_response_content(response_length)
+
+def _content_for_auto_length(response_length: str, model_config: ModelConfig) -> str:
+    """Use model's speed to determine appropriate response length from configuration"""
+    return get_response_content(get_auto_response_length(model_config.tokens_per_second))
+
+# Response content lookup for response_length values that need special handling;
+# any other value is passed straight to get_response_content
+_LENGTH_DISPATCH = {
+    "auto": _content_for_auto_length,
+}
+
+def _build_completion_bytes(model: str, content: str, usage: Dict[str, int], now: int) -> bytes:
+    """Serialize a non-streaming chat completion response"""
+    return orjson.dumps({
+        "id": _COMPLETION_ID_PREFIX + str(next(_COMPLETION_ID_COUNTER)),
+        "object": "chat.completion",
+        "created": now,
+        "model": model,
+        "choices": [{
+            "message": {
+                "role": "assistant",
+                "content": content,
+            },
+            "finish_reason": "stop",
+            "index": 0
+        }],
+        "usage": usage
+    })
 
 @router.post("/v1/chat/completions", dependencies=[Depends(ensure_config_loaded), Depends(ignore_api_key)])
 async def create_chat_completion(request: CompletionRequest):
@@ -91,7 +143,7 @@ async def create_chat_completion(request: CompletionRequest):
         )
     
     # Get model configuration
-    model_config = MODEL_CONFIGS.get(model, DEFAULT_CONFIG)
+    model_config = MODEL_CONFIGS.get(model, app_config.DEFAULT_CONFIG)
     
     # Get response content based on requested length, duration, or model speed
     if request.duration_seconds is not None:
@@ -101,55 +153,43 @@ async def create_chat_completion(request: CompletionRequest):
             model,
             tokens_per_second=model_config.tokens_per_second
         )
-    elif request.response_length == "auto":
-        # Use model's speed to determine appropriate response length from configuration
-        from app.config import get_auto_response_length
-        auto_length = get_auto_response_length(model_config.tokens_per_second)
-        response_content = get_response_content(auto_length)
     else:
-        response_content = get_response_content(request.response_length)
+        content_for_length = _LENGTH_DISPATCH.get(request.response_length, _content_for_length)
+        response_content = content_for_length(request.response_length, model_config)
 
     # Calculate usage statistics
     usage = calculate_usage(request.messages, response_content)
 
     if not request.stream:
         # Non-streaming response
-        return {
-            "id": f"mock-completion-{int(time.time())}",
-            "object": "chat.completion",
-            "created": int(time.time()),
-            "model": model,
-            "choices": [{
-                "message": {
-                    "role": "assistant",
-                    "content": response_content,
-                },
-                "finish_reason": "stop",
-                "index": 0
-            }],
-            "usage": usage
-        }
+        body = _build_completion_bytes(model, response_content, usage, int(time.time()))
+        return Response(content=body, media_type="application/json")
     else:
         # Streaming response
         return StreamingResponse(
             stream_response(response_content, model, request.messages),
-            media_type="text/event-stream"
+            headers=_STREAM_HEADERS
         )
 
 @router.get("/v1/models", dependencies=[Depends(ensure_config_loaded), Depends(ignore_api_key)])
-def list_models():
+async def list_models():
     """Return a list of available models in OpenAI-compatible format"""
+    global _MODELS_CACHE
+    if _MODELS_CACHE is not None and _MODELS_CACHE[0] == app_config.CONFIG_VERSION:
+        return Response(content=_MODELS_CACHE[1], media_type="application/json")
+
+    now = int(time.time())
     models_list = []
     for model_id, config in MODEL_CONFIGS.items():
         models_list.append({
             "id": model_id,
             "object": "model",
-            "created": int(time.time()),
+            "created": now,
             "owned_by": "openai-stream-mocker",
             "permission": [{
                 "id": f"modelperm-{model_id}",
                 "object": "model_permission",
-                "created": int(time.time()),
+                "created": now,
                 "organization": "*",
                 "group": None,
                 "is_blocking": False,
@@ -167,10 +207,12 @@ def list_models():
         })
     
     # Return in the format expected by OpenAI clients
-    return {
+    body = orjson.dumps({
         "object": "list",
         "data": models_list
-    }
+    })
+    _MODELS_CACHE = (app_config.CONFIG_VERSION, body)
+    return Response(content=body, media_type="application/json")
 
 @router.post("/config", dependencies=[Depends(ignore_api_key)])
 async def update_config(request: Request):
@@ -182,7 +224,8 @@ async def update_config(request: Request):
         tokens_per_second = float(data["tokens_per_second"])
         
         if model in MODEL_CONFIGS:
-            MODEL_CONFIGS[model].tokens_per_second = tokens_per_second
+            MODEL_CONFIGS[model] = MODEL_CONFIGS[model].model_copy(update={"tokens_per_second": tokens_per_second})
+            bump_config_version()
             return {"message": f"Tokens per second for model {model} updated to {tokens_per_second}"}
         else:
             # Add new model
@@ -193,6 +236,7 @@ async def update_config(request: Request):
                 description=description,
                 parameters=parameters
             )
+            bump_config_version()
             return {"message": f"Added new model {model} with {tokens_per_second} tokens per second"}
     
     # Update model with parameter-based speed estimation
@@ -201,9 +245,11 @@ async def update_config(request: Request):
         parameters = float(data["parameters"])
         
         if model in MODEL_CONFIGS:
-            MODEL_CONFIGS[model].parameters = parameters
             new_speed = estimate_speed_from_parameters(parameters)
-            MODEL_CONFIGS[model].tokens_per_second = new_speed
+            MODEL_CONFIGS[model] = MODEL_CONFIGS[model].model_copy(
+                update={"parameters": parameters, "tokens_per_second": new_speed}
+            )
+            bump_config_version()
             return {
                 "message": f"Updated {model} with {parameters}B parameters, estimated speed: {new_speed:.2f} tokens/sec"
             }
@@ -216,6 +262,7 @@ async def update_config(request: Request):
                 description=description,
                 parameters=parameters
             )
+            bump_config_version()
             return {
                 "message": f"Added model {model} with {parameters}B parameters, estimated speed: {new_speed:.2f} tokens/sec"
             }
@@ -223,36 +270,41 @@ async def update_config(request: Request):
     # Update default config
     elif "tokens_per_second" in data:
         tokens_per_second = float(data["tokens_per_second"])
-        DEFAULT_CONFIG.tokens_per_second = tokens_per_second
+        set_default_config(app_config.DEFAULT_CONFIG.model_copy(update={"tokens_per_second": tokens_per_second}))
         return {"message": f"Default tokens per second updated to {tokens_per_second}"}
         
     return {"message": "No changes made"}
 
 @router.get("/config", dependencies=[Depends(ignore_api_key)])
-def get_config():
+async def get_config():
     """Get current configuration for all models"""
-    config_data = {
-        "default": DEFAULT_CONFIG.dict(),
-        "models": {model: config.dict() for model, config in MODEL_CONFIGS.items()}
-    }
-    return config_data
+    global _CONFIG_CACHE
+    if _CONFIG_CACHE is None or _CONFIG_CACHE[0] != app_config.CONFIG_VERSION:
+        config_data = {
+            "default": app_config.DEFAULT_CONFIG.model_dump(),
+            "models": {model: config.model_dump() for model, config in MODEL_CONFIGS.items()}
+        }
+        _CONFIG_CACHE = (app_config.CONFIG_VERSION, orjson.dumps(config_data))
+    return Response(content=_CONFIG_CACHE[1], media_type="application/json")
 
 @router.get("/config/{model}", dependencies=[Depends(ignore_api_key)])
-def get_model_config(model: str):
+async def get_model_config(model: str):
     """Get configuration for a specific model"""
     if model in MODEL_CONFIGS:
-        return MODEL_CONFIGS[model].dict()
+        return MODEL_CONFIGS[model].model_dump()
     elif model == "default":
-        return DEFAULT_CONFIG.dict()
+        return app_config.DEFAULT_CONFIG.model_dump()
     else:
         raise HTTPException(status_code=404, detail=f"Model {model} not found")
 
-@router.get("/responses", dependencies=[Depends(ignore_api_key)])
-def list_response_options():
-    """Get available response length options and preview"""
+def _rebuild_response_options():
+    """Build the /responses payload from the currently loaded sample responses"""
+    global _RESPONSE_OPTIONS_CACHE
     response_options = {}
     for length, content in SAMPLE_RESPONSES.items():
-        token_count = estimate_token_count(content)
+        # Plain ~4 characters per token; unlike usage estimates, very short
+        # contents are reported as 0 tokens
+        token_count = len(content) // 4
         preview = content[:50] + "..." if len(content) > 50 else content
         response_options[length] = {
             "token_estimate": token_count,
@@ -265,48 +317,48 @@ def list_response_options():
         "example": "Send a request with {'duration_seconds': 10} for a 10-second response"
     }
     
+    _RESPONSE_OPTIONS_CACHE = (app_config.CONFIG_VERSION, response_options)
     return response_options
 
+@router.get("/responses", dependencies=[Depends(ignore_api_key)])
+async def list_response_options():
+    """Get available response length options and preview"""
+    if _RESPONSE_OPTIONS_CACHE is None or _RESPONSE_OPTIONS_CACHE[0] != app_config.CONFIG_VERSION:
+        return _rebuild_response_options()
+    return _RESPONSE_OPTIONS_CACHE[1]
+
 @router.post("/config/reload", dependencies=[Depends(ignore_api_key)])
 def reload_configuration():
     """Reload configuration from TOML file"""
     new_config = reload_config()
+    _rebuild_response_options()
     return {"message": "Configuration reloaded successfully"}
 
-def estimate_token_count(text: str) -> int:
-    """Estimate token count for a given text"""
-    # Simple approximation: ~4 characters per token
-    return len(text) // 4
-
 @router.post("/config/time-limit", dependencies=[Depends(ignore_api_key)])
 async def update_time_limit(request: Request):
     """Update time limit settings"""
     data = await request.json()
     
-    global MAX_STREAM_TIME_SECONDS, ENFORCE_TIME_LIMIT
-    
     if "max_seconds" in data:
-        from app.config import MAX_STREAM_TIME_SECONDS
-        old_value = MAX_STREAM_TIME_SECONDS
-        MAX_STREAM_TIME_SECONDS = int(data["max_seconds"])
+        old_value = app_config.MAX_STREAM_TIME_SECONDS
+        set_time_limit(int(data["max_seconds"]))
         return {
-            "message": f"Time limit updated from {old_value} to {MAX_STREAM_TIME_SECONDS} seconds",
-            "enforce": ENFORCE_TIME_LIMIT
+            "message": f"Time limit updated from {old_value} to {app_config.MAX_STREAM_TIME_SECONDS} seconds",
+            "enforce": app_config.ENFORCE_TIME_LIMIT
         }
         
     if "enforce" in data:
-        from app.config import ENFORCE_TIME_LIMIT
-        old_value = ENFORCE_TIME_LIMIT
-        ENFORCE_TIME_LIMIT = bool(data["enforce"])
+        old_value = app_config.ENFORCE_TIME_LIMIT
+        set_enforce_time_limit(bool(data["enforce"]))
         return {
-            "message": f"Time limit enforcement changed from {old_value} to {ENFORCE_TIME_LIMIT}",
-            "limit_seconds": MAX_STREAM_TIME_SECONDS
+            "message": f"Time limit enforcement changed from {old_value} to {app_config.ENFORCE_TIME_LIMIT}",
+            "limit_seconds": app_config.MAX_STREAM_TIME_SECONDS
         }
     
     # Return current settings if no changes
     return {
-        "max_seconds": MAX_STREAM_TIME_SECONDS,
-        "enforce": ENFORCE_TIME_LIMIT
+        "max_seconds": app_config.MAX_STREAM_TIME_SECONDS,
+        "enforce": app_config.ENFORCE_TIME_LIMIT
     }
 
 @router.post("/config/time-control", dependencies=[Depends(ignore_api_key)])
@@ -315,18 +367,17 @@ async def set_time_control(request: Request):
     data = await request.json()
     
     # For global settings
-    from app.config import MAX_STREAM_TIME_SECONDS, ENFORCE_TIME_LIMIT
     updates = {}
     
     if "enforce" in data:
-        old_value = ENFORCE_TIME_LIMIT
-        ENFORCE_TIME_LIMIT = bool(data["enforce"])
-        updates["enforce"] = f"Changed from {old_value} to {ENFORCE_TIME_LIMIT}"
+        old_value = app_config.ENFORCE_TIME_LIMIT
+        set_enforce_time_limit(bool(data["enforce"]))
+        updates["enforce"] = f"Changed from {old_value} to {app_config.ENFORCE_TIME_LIMIT}"
         
     if "global_seconds" in data:
-        old_value = MAX_STREAM_TIME_SECONDS
-        MAX_STREAM_TIME_SECONDS = int(data["global_seconds"])
-        updates["global_seconds"] = f"Changed from {old_value} to {MAX_STREAM_TIME_SECONDS}"
+        old_value = app_config.MAX_STREAM_TIME_SECONDS
+        set_time_limit(int(data["global_seconds"]))
+        updates["global_seconds"] = f"Changed from {old_value} to {app_config.MAX_STREAM_TIME_SECONDS}"
     
     # For model-specific settings
     if "model_settings" in data and isinstance(data["model_settings"], dict):
@@ -334,18 +385,21 @@ async def set_time_control(request: Request):
         for model_id, seconds in model_settings.items():
             if model_id in MODEL_CONFIGS:
                 old_value = getattr(MODEL_CONFIGS[model_id], "max_stream_time_seconds", None)
-                MODEL_CONFIGS[model_id].max_stream_time_seconds = int(seconds)
+                MODEL_CONFIGS[model_id] = MODEL_CONFIGS[model_id].model_copy(
+                    update={"max_stream_time_seconds": int(seconds)}
+                )
+                bump_config_version()
                 updates[f"model_{model_id}"] = f"Changed from {old_value} to {seconds} seconds"
     
     if not updates:
         # Return current settings
         model_settings = {
-            model: getattr(config, "max_stream_time_seconds", MAX_STREAM_TIME_SECONDS) 
+            model: getattr(config, "max_stream_time_seconds", app_config.MAX_STREAM_TIME_SECONDS) 
             for model, config in MODEL_CONFIGS.items()
         }
         return {
-            "enforce_time_limit": ENFORCE_TIME_LIMIT,
-            "global_seconds": MAX_STREAM_TIME_SECONDS,
+            "enforce_time_limit": app_config.ENFORCE_TIME_LIMIT,
+            "global_seconds": app_config.MAX_STREAM_TIME_SECONDS,
             "model_settings": model_settings
         }
     
@@ -353,20 +407,18 @@ async def set_time_control(request: Request):
         "message": "Time control settings updated",
         "updates": updates,
         "current": {
-            "enforce": ENFORCE_TIME_LIMIT,
-            "global_seconds": MAX_STREAM_TIME_SECONDS
+            "enforce": app_config.ENFORCE_TIME_LIMIT,
+            "global_seconds": app_config.MAX_STREAM_TIME_SECONDS
         }
     }
 
 @router.get("/debug/settings", dependencies=[Depends(ignore_api_key)])
-def get_debug_settings():
+async def get_debug_settings():
     """Get current debug settings including time limits"""
-    from app.config import MAX_STREAM_TIME_SECONDS, ENFORCE_TIME_LIMIT, MODEL_CONFIGS, DEFAULT_CONFIG
-    
     return {
-        "time_limit_seconds": MAX_STREAM_TIME_SECONDS,
-        "enforce_time_limit": ENFORCE_TIME_LIMIT,
-        "default_tokens_per_second": DEFAULT_CONFIG.tokens_per_second,
+        "time_limit_seconds": app_config.MAX_STREAM_TIME_SECONDS,
+        "enforce_time_limit": app_config.ENFORCE_TIME_LIMIT,
+        "default_tokens_per_second": app_config.DEFAULT_CONFIG.tokens_per_second,
         "model_count": len(MODEL_CONFIGS),
         "models": {model: config.tokens_per_second for model, config in MODEL_CONFIGS.items()}
     }
@@ -1,13 +1,31 @@
-import tomli
+import os
+from bisect import bisect_right
 from typing import Dict, Any
 from app.models import ModelConfig
 from app.utils import estimate_speed_from_parameters
 
+try:
+    import tomllib
+except ImportError:  # Python < 3.11
+    import tomli as tomllib
+
+# Most recently parsed config file: (path, mtime_ns, size, parsed config).
+# A single slot is enough since the server only ever reloads one file
+_CFG_CACHE = None
+
 def load_config(config_path='config.toml'):
-    """Load configuration from TOML file"""
+    """Load configuration from TOML file, reusing the parsed result while the file is unchanged"""
+    global _CFG_CACHE
     try:
+        st = os.stat(config_path)
+        key = (config_path, st.st_mtime_ns, st.st_size)
+        if _CFG_CACHE is not None and _CFG_CACHE[:3] == key:
+            return _CFG_CACHE[3]
+        
         with open(config_path, 'rb') as f:
-            return tomli.load(f)
+            parsed = tomllib.load(f)
+        _CFG_CACHE = key + (parsed,)
+        return parsed
     except Exception as e:
         print(f"Error loading config: {e}")
         return {}
@@ -17,11 +35,22 @@ config = load_config()
 MODEL_CONFIGS = {}
 DEFAULT_CONFIG = None
 SAMPLE_RESPONSES = {}
+# Response lengths eligible for "random", rebuilt with SAMPLE_RESPONSES
+SAMPLE_RESPONSE_KEYS = ()
+# Sample responses keyed by a character length, as ascending lengths with
+# the matching SAMPLE_RESPONSES keys and their position in the config, which
+# breaks ties between lengths equally close to a target
+SIZED_RESPONSE_LENGTHS = ()
+SIZED_RESPONSE_KEYS = ()
+SIZED_RESPONSE_ORDER = ()
 # Set defaults that will be used if not overridden by config file
 MAX_STREAM_TIME_SECONDS = 60
 ENFORCE_TIME_LIMIT = False
 TRUNCATION_MESSAGE = "\n\nI've reached the response time limit, but I hope this information helps. Let me know if you need more details."
 DEFAULT_RESPONSE_MODE = "auto"  # Use auto by default to adapt to model speed
+# Incremented on every configuration change; caches built from the
+# configuration store the version they were built from
+CONFIG_VERSION = 0
 
 # Response length settings for auto mode
 AUTO_RESPONSE_LENGTH_CONFIG = {
@@ -30,6 +59,49 @@ AUTO_RESPONSE_LENGTH_CONFIG = {
     "long": {"max_tokens_per_second": 77.0, "response_length": "long"},
     "fast": {"max_tokens_per_second": float('inf'), "response_length": "very_long"}
 }
+# Auto response length thresholds in ascending order, with the matching
+# response lengths, rebuilt whenever AUTO_RESPONSE_LENGTH_CONFIG changes
+_AUTO_THRESHOLD_KEYS = ()
+_AUTO_THRESHOLD_VALS = ()
+
+def _build_auto_thresholds():
+    """Precompute the sorted thresholds used by get_auto_response_length"""
+    global _AUTO_THRESHOLD_KEYS, _AUTO_THRESHOLD_VALS
+    # Sorting descending and reversing keeps the first configured category
+    # winning among equal thresholds
+    ordered = sorted(
+        AUTO_RESPONSE_LENGTH_CONFIG.values(),
+        key=lambda x: x['max_tokens_per_second'],
+        reverse=True,
+    )[::-1]
+    _AUTO_THRESHOLD_KEYS = tuple(c['max_tokens_per_second'] for c in ordered)
+    _AUTO_THRESHOLD_VALS = tuple(c['response_length'] for c in ordered)
+
+_build_auto_thresholds()
+
+def _build_response_keys():
+    """Precompute the response keys used by "random" and duration-based lookups"""
+    global SAMPLE_RESPONSE_KEYS, SIZED_RESPONSE_LENGTHS, SIZED_RESPONSE_KEYS, SIZED_RESPONSE_ORDER
+    SAMPLE_RESPONSE_KEYS = tuple(k for k in SAMPLE_RESPONSES if k != "auto")
+
+    # Responses whose key is a character length, for duration-based lookups
+    sized = {}
+    for order, length in enumerate(SAMPLE_RESPONSE_KEYS):
+        try:
+            n = int(length)
+        except ValueError:
+            continue
+        # The first configured key wins among equal lengths
+        sized.setdefault(n, (length, order))
+    lengths = sorted(sized)
+    SIZED_RESPONSE_LENGTHS = tuple(lengths)
+    SIZED_RESPONSE_KEYS = tuple(sized[n][0] for n in lengths)
+    SIZED_RESPONSE_ORDER = tuple(sized[n][1] for n in lengths)
+
+def bump_config_version():
+    """Mark the configuration as changed so derived caches get rebuilt"""
+    global CONFIG_VERSION
+    CONFIG_VERSION += 1
 
 def init_config():
     """Initialize configuration from the loaded config file"""
@@ -73,6 +145,7 @@ def init_config():
                     AUTO_RESPONSE_LENGTH_CONFIG[speed_category]['max_tokens_per_second'] = float(settings['max_tokens_per_second'])
                 if 'response_length' in settings:
                     AUTO_RESPONSE_LENGTH_CONFIG[speed_category]['response_length'] = settings['response_length']
+    _build_auto_thresholds()
 
     # Load sample responses from TOML
     if config and 'responses' in config:
@@ -82,6 +155,9 @@ def init_config():
     # Make sure we have at least one sample response
     if not SAMPLE_RESPONSES:
         SAMPLE_RESPONSES["medium"] = "This is a sample response from the OpenAI Stream Mocker."
+    _build_response_keys()
+    
+    bump_config_version()
     
     return {
         "models": MODEL_CONFIGS,
@@ -99,19 +175,30 @@ def reload_config():
     config = load_config()
     return init_config()
 
+def set_time_limit(seconds):
+    """Update the global maximum streaming time in seconds"""
+    global MAX_STREAM_TIME_SECONDS
+    MAX_STREAM_TIME_SECONDS = seconds
+    bump_config_version()
+
+def set_default_config(model_config):
+    """Replace the configuration used for models without their own entry"""
+    global DEFAULT_CONFIG
+    DEFAULT_CONFIG = model_config
+    bump_config_version()
+
+def set_enforce_time_limit(enforce):
+    """Enable or disable enforcement of the streaming time limit"""
+    global ENFORCE_TIME_LIMIT
+    ENFORCE_TIME_LIMIT = enforce
+    bump_config_version()
+
 def get_auto_response_length(tokens_per_second):
     """Determine response length based on model speed using configuration"""
-    # Sort speed categories from slowest to fastest
-    sorted_categories = sorted(
-        AUTO_RESPONSE_LENGTH_CONFIG.items(), 
-        key=lambda x: x[1]['max_tokens_per_second'],
-        reverse=True,
-    )
-    
-    # Find the appropriate category based on tokens_per_second
-    for category, config in sorted_categories:
-        if tokens_per_second >= config['max_tokens_per_second']:
-            return config['response_length']
+    # Pick the category with the highest threshold not above tokens_per_second
+    i = bisect_right(_AUTO_THRESHOLD_KEYS, tokens_per_second) - 1
+    if i >= 0:
+        return _AUTO_THRESHOLD_VALS[i]
             
-    # Default to medium if no match (should not happen with infinity as max)
+    # Default to medium if no match (tokens_per_second below every threshold)
     return "medium"
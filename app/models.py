@@ -1,13 +1,15 @@
-from typing import Optional, List, Dict
-from pydantic import BaseModel
+from typing import Optional, List
+from pydantic import BaseModel, ConfigDict
 
 class Message(BaseModel):
+    model_config = ConfigDict(frozen=True)
+    
     role: str
     content: str
 
 class CompletionRequest(BaseModel):
     model: str
-    messages: List[Dict[str, str]]
+    messages: List[Message]
     temperature: Optional[float] = 1.0
     top_p: Optional[float] = 1.0
     n: Optional[int] = 1
@@ -20,6 +22,10 @@ class CompletionRequest(BaseModel):
 
 class ModelConfig(BaseModel):
     """Configuration for a specific model"""
+    # Read on every request and never edited in place; updates replace the
+    # instance via model_copy
+    model_config = ConfigDict(frozen=True)
+    
     tokens_per_second: float
     description: str = None
     parameters: Optional[float] = None
@@ -1,70 +1,168 @@
 import asyncio
-import json
+import bisect
+import itertools
 import time
 import random
 import re
-from typing import List, AsyncGenerator, Dict, Any
+from typing import List, AsyncGenerator, Any, Tuple, Dict, FrozenSet, Optional
+
+import orjson
 from app.models import Message, ModelConfig
-from app.utils import estimate_token_count, calculate_usage
-from app.config import MODEL_CONFIGS, DEFAULT_CONFIG, SAMPLE_RESPONSES
-from app.config import MAX_STREAM_TIME_SECONDS, ENFORCE_TIME_LIMIT, TRUNCATION_MESSAGE
+from app.utils import estimate_token_counts, calculate_usage
+import app.config as app_config
+from app.config import MODEL_CONFIGS, SAMPLE_RESPONSES
 
-async def stream_response(content: str, model: str, messages: List[Dict[str, str]]) -> AsyncGenerator[str, None]:
-    """Stream response with appropriate token generation speed for the model"""
-    # Get tokens per second for this model
-    model_config = MODEL_CONFIGS.get(model, DEFAULT_CONFIG)
-    tokens_per_second = model_config.tokens_per_second
+# Server-sent event framing, pre-encoded since frames are emitted as bytes
+_SSE_PREFIX = b"data: "
+_SSE_SUFFIX = b"\n\n"
+_SSE_DONE = b"data: [DONE]\n\n"
+
+# Blank lines (possibly containing whitespace) separate paragraphs
+_PARA_RE = re.compile(r'\n\s*\n')
+
+# lorem is only needed when no sample response fits a requested duration,
+# so it is imported on first use
+_lorem = None
+# Marks a paragraph boundary in the chunk list; compared by identity so
+# content can never be mistaken for it
+_PARA_BREAK = object()
+# Longest sleep, in seconds, a batch of chunks may add up to before it is sent
+_MAX_BATCH_DELAY = 0.25
+# Generated lorem paragraphs, built once and sliced for each request; longer
+# requests repeat it rather than growing it
+_LOREM_CORPUS_SIZE = 200_000
+_lorem_corpus = ""
+_WS_RE = re.compile(r'\s')
+# Chunked sample responses, keyed by (content, chunk_size_factor), together
+# with the config version and sample contents they were built for. Only
+# configured samples are cached so generated duration content is not retained.
+_CHUNKS_CACHE: Optional[Tuple[int, FrozenSet[str], Dict[Tuple[str, float], tuple]]] = None
+
+def _lorem_text(min_length: int) -> str:
+    """Return lorem ipsum paragraphs of at least min_length characters, cut at a word boundary"""
+    global _lorem, _lorem_corpus
+    if not _lorem_corpus:
+        import lorem as _lorem
+        parts = []
+        length = 0
+        while length < _LOREM_CORPUS_SIZE:
+            paragraph = _lorem.paragraph() + "\n\n"
+            parts.append(paragraph)
+            length += len(paragraph)
+        _lorem_corpus = "".join(parts)
     
-    # Check for model-specific time limit override
-    model_time_limit = getattr(model_config, "max_stream_time_seconds", MAX_STREAM_TIME_SECONDS)
-    effective_time_limit = model_time_limit if model_time_limit else MAX_STREAM_TIME_SECONDS
+    corpus = _lorem_corpus
+    if len(corpus) <= min_length:
+        corpus = corpus * (min_length // len(corpus) + 1)
     
-    # Log the current settings
-    print(f"Streaming with model: {model}, Speed: {tokens_per_second} tokens/s")
-    print(f"Time limit: {effective_time_limit}s (Global: {MAX_STREAM_TIME_SECONDS}s), Enforce limit: {ENFORCE_TIME_LIMIT}")
+    # Every paragraph ends in whitespace, so a word boundary follows min_length
+    end = _WS_RE.search(corpus, min_length).start()
+    return corpus[:end].strip()
+
+def _prepare_chunks(content: str, chunk_size_factor: float) -> Tuple[Tuple[str, ...], Tuple[int, ...], Tuple[int, ...], Tuple[int, ...]]:
+    """
+    Split content into streaming chunks, caching the result for configured
+    sample responses since those are streamed over and over
+    """
+    global _CHUNKS_CACHE
+    if _CHUNKS_CACHE is None or _CHUNKS_CACHE[0] != app_config.CONFIG_VERSION:
+        _CHUNKS_CACHE = (app_config.CONFIG_VERSION, frozenset(SAMPLE_RESPONSES.values()), {})
+    _, sample_contents, cache = _CHUNKS_CACHE
+    if content not in sample_contents:
+        return _split_chunks(content, chunk_size_factor)
     
+    key = (content, chunk_size_factor)
+    result = cache.get(key)
+    if result is None:
+        result = cache[key] = _split_chunks(content, chunk_size_factor)
+    return result
+
+def _split_chunks(content: str, chunk_size_factor: float) -> Tuple[Tuple[str, ...], Tuple[int, ...], Tuple[int, ...], Tuple[int, ...]]:
+    """
+    Split content into streaming chunks, with _PARA_BREAK markers between paragraphs.
+    Returns the chunks, the estimated token count of each chunk (0 for markers),
+    the running token total after each chunk and the indices of the markers.
+    """
     # Process content to identify paragraph boundaries
-    paragraphs = re.split(r'\n\s*\n', content)
-    
-    # For high-speed models, use larger chunks to reduce overhead
-    chunk_size_factor = 1.0
-    if tokens_per_second > 50:
-        chunk_size_factor = min(3.0, tokens_per_second / 30)  # Scale chunk size with model speed
+    paragraphs = _PARA_RE.split(content)
     
     # Split paragraphs into chunks for streaming
     chunks = []
+    break_indices = []
     for paragraph in paragraphs:
         # Split paragraph into words
         words = paragraph.split()
         current_chunk = []
+        # Length of ' '.join(current_chunk) plus one, tracked incrementally
+        current_len = 0
         
         target_chunk_size = 10 * chunk_size_factor
+        flush_len = target_chunk_size + 1
         
         for word in words:
             current_chunk.append(word)
+            current_len += len(word) + 1
             # Create chunks of approximately token size, scaled by speed
-            if len(' '.join(current_chunk)) >= target_chunk_size:  
+            if current_len >= flush_len:
                 chunks.append(' '.join(current_chunk))
                 current_chunk = []
+                current_len = 0
         
         if current_chunk:
             chunks.append(' '.join(current_chunk))
         
         # Mark paragraph boundaries with a special token
-        chunks.append("__PARAGRAPH_BREAK__")
+        break_indices.append(len(chunks))
+        chunks.append(_PARA_BREAK)
     
     # Remove the last paragraph break
-    if chunks and chunks[-1] == "__PARAGRAPH_BREAK__":
+    if chunks and chunks[-1] is _PARA_BREAK:
         chunks.pop()
+        break_indices.pop()
+    
+    # Estimate all chunk token counts in one batch; markers count as empty text
+    chunk_token_counts = estimate_token_counts(["" if chunk is _PARA_BREAK else chunk for chunk in chunks])
+    return (
+        tuple(chunks),
+        tuple(chunk_token_counts),
+        tuple(itertools.accumulate(chunk_token_counts)),
+        tuple(break_indices),
+    )
+
+async def stream_response(content: str, model: str, messages: List[Message]) -> AsyncGenerator[bytes, None]:
+    """Stream response with appropriate token generation speed for the model"""
+    # Get tokens per second for this model
+    model_config = MODEL_CONFIGS.get(model, app_config.DEFAULT_CONFIG)
+    tokens_per_second = model_config.tokens_per_second
+    
+    # Check for model-specific time limit override
+    max_stream_time_seconds = app_config.MAX_STREAM_TIME_SECONDS
+    enforce_time_limit = app_config.ENFORCE_TIME_LIMIT
+    truncation_message = app_config.TRUNCATION_MESSAGE
+    model_time_limit = getattr(model_config, "max_stream_time_seconds", max_stream_time_seconds)
+    effective_time_limit = model_time_limit if model_time_limit else max_stream_time_seconds
+    
+    # Log the current settings
+    print(f"Streaming with model: {model}, Speed: {tokens_per_second} tokens/s")
+    print(f"Time limit: {effective_time_limit}s (Global: {max_stream_time_seconds}s), Enforce limit: {enforce_time_limit}")
+    
+    # For high-speed models, use larger chunks to reduce overhead
+    chunk_size_factor = 1.0
+    if tokens_per_second > 50:
+        chunk_size_factor = min(3.0, tokens_per_second / 30)  # Scale chunk size with model speed
     
-    # Generate a consistent ID for this response
-    response_id = f"mock-chatcmpl-{int(time.time())}"
+    # Split content into chunks (cached for repeated content)
+    chunks, chunk_token_counts, cumulative_tokens, break_indices = _prepare_chunks(content, chunk_size_factor)
+    
+    # Generate a consistent ID and creation timestamp for this response
+    created = int(time.time())
+    response_id = f"mock-chatcmpl-{created}"
     
     # First chunk with role
     first_data = {
         "id": response_id,
         "object": "chat.completion.chunk",
-        "created": int(time.time()),
+        "created": created,
         "model": model,
         "choices": [{
             "index": 0,
@@ -74,11 +172,33 @@ async def stream_response(content: str, model: str, messages: List[Dict[str, str
             "finish_reason": None
         }]
     }
-    yield f"data: {json.dumps(first_data)}\n\n"
+    yield _SSE_PREFIX + orjson.dumps(first_data) + _SSE_SUFFIX
+    
+    # Content frames only differ in the delta content, so the JSON around it
+    # is built once per stream
+    frame_head = (
+        _SSE_PREFIX + b'{"id":' + orjson.dumps(response_id)
+        + b',"object":"chat.completion.chunk","created":' + str(created).encode()
+        + b',"model":' + orjson.dumps(model)
+        + b',"choices":[{"index":0,"delta":{"content":'
+    )
+    frame_tail = b'},"finish_reason":null}]}' + _SSE_SUFFIX
+    
+    dumps = orjson.dumps
     
-    # Start timing from here
-    start_time = time.time()
-    total_tokens = 0
+    def content_frame(text: str) -> bytes:
+        return frame_head + dumps(text) + frame_tail
+    
+    # Bind names used on every iteration to locals for the streaming loop
+    sleep = asyncio.sleep
+    monotonic = time.monotonic
+    para_break = _PARA_BREAK
+    max_batch_delay = _MAX_BATCH_DELAY
+    n_chunks = len(chunks)
+    
+    # Start timing from here, using a monotonic clock for the time limit
+    start_time = monotonic()
+    deadline = start_time + effective_time_limit
     current_paragraph_chunks = []
     exceeded_time_limit = False
     
@@ -89,56 +209,24 @@ async def stream_response(content: str, model: str, messages: List[Dict[str, str
         batch_size = min(5, int(tokens_per_second / 20))
     
     i = 0
-    while i < len(chunks):
+    while i < n_chunks:
         # CHECK TIME LIMIT: Check if we've exceeded time limit
-        current_time = time.time()
-        elapsed_time = current_time - start_time
-        
         # If enforcing time limit and we've exceeded it, prepare to complete the current paragraph and stop
-        if ENFORCE_TIME_LIMIT and elapsed_time >= effective_time_limit:
-            print(f"Time limit reached: {elapsed_time:.2f}s > {effective_time_limit}s")
+        if enforce_time_limit and monotonic() >= deadline:
+            print(f"Time limit reached: {monotonic() - start_time:.2f}s > {effective_time_limit}s")
             exceeded_time_limit = True
             
             # Find the next paragraph break to complete the current paragraph
-            next_break = i
-            while next_break < len(chunks) and chunks[next_break] != "__PARAGRAPH_BREAK__":
-                next_break += 1
+            b = bisect.bisect_left(break_indices, i)
+            next_break = break_indices[b] if b < len(break_indices) else n_chunks
                 
             # Complete the current paragraph
-            for j in range(i, next_break):
-                chunk = chunks[j]
-                if chunk != "__PARAGRAPH_BREAK__":
-                    data = {
-                        "id": response_id,
-                        "object": "chat.completion.chunk",
-                        "created": int(time.time()),
-                        "model": model,
-                        "choices": [{
-                            "index": 0,
-                            "delta": {
-                                "content": chunk,
-                            },
-                            "finish_reason": None
-                        }]
-                    }
-                    yield f"data: {json.dumps(data)}\n\n"
+            for chunk in chunks[i:next_break]:
+                yield content_frame(chunk)
             
             # Add truncation message if configured
-            if TRUNCATION_MESSAGE:
-                data = {
-                    "id": response_id,
-                    "object": "chat.completion.chunk",
-                    "created": int(time.time()),
-                    "model": model,
-                    "choices": [{
-                        "index": 0,
-                        "delta": {
-                            "content": "\n\n" + TRUNCATION_MESSAGE,
-                        },
-                        "finish_reason": None
-                    }]
-                }
-                yield f"data: {json.dumps(data)}\n\n"
+            if truncation_message:
+                yield content_frame("\n\n" + truncation_message)
             
             break
         
@@ -146,23 +234,10 @@ async def stream_response(content: str, model: str, messages: List[Dict[str, str
         chunk = chunks[i]
         
         # If this is a paragraph break marker
-        if chunk == "__PARAGRAPH_BREAK__":
+        if chunk is para_break:
             # Add a new line between paragraphs
             if current_paragraph_chunks:
-                data = {
-                    "id": response_id,
-                    "object": "chat.completion.chunk",
-                    "created": int(time.time()),
-                    "model": model,
-                    "choices": [{
-                        "index": 0,
-                        "delta": {
-                            "content": "\n\n",
-                        },
-                        "finish_reason": None
-                    }]
-                }
-                yield f"data: {json.dumps(data)}\n\n"
+                yield content_frame("\n\n")
                 
                 # Clear paragraph buffer
                 current_paragraph_chunks = []
@@ -170,38 +245,34 @@ async def stream_response(content: str, model: str, messages: List[Dict[str, str
             i += 1
             continue
         
-        # Add chunk to current paragraph
-        current_paragraph_chunks.append(chunk)
+        # Batch the following chunks of this paragraph with it, as long as the
+        # combined delay stays short enough for time limit checks to fire
+        batch_tokens = chunk_token_counts[i]
+        end = i + 1
+        batch_end = min(i + batch_size, n_chunks)
+        while end < batch_end and chunks[end] is not para_break:
+            if (batch_tokens + chunk_token_counts[end]) / tokens_per_second > max_batch_delay:
+                break
+            batch_tokens += chunk_token_counts[end]
+            end += 1
         
-        # Calculate tokens and delay for this chunk
-        chunk_tokens = max(1, estimate_token_count(chunk))
-        total_tokens += chunk_tokens
-        delay = chunk_tokens / tokens_per_second
+        # Add batch to current paragraph
+        current_paragraph_chunks.extend(chunks[i:end])
+        
+        # Calculate delay for this batch
+        delay = batch_tokens / tokens_per_second
         
         # Apply delay
-        await asyncio.sleep(delay)
+        await sleep(delay)
         
-        # Send the chunk
-        data = {
-            "id": response_id,
-            "object": "chat.completion.chunk",
-            "created": int(time.time()),
-            "model": model,
-            "choices": [{
-                "index": 0,
-                "delta": {
-                    "content": chunk,
-                },
-                "finish_reason": None
-            }]
-        }
-        yield f"data: {json.dumps(data)}\n\n"
+        # Send the batch as a single frame
+        yield content_frame("".join(chunks[i:end]))
         
-        i += 1
+        i = end
     
     # Calculate actual token throughput
-    end_time = time.time()
-    elapsed_time = end_time - start_time
+    elapsed_time = monotonic() - start_time
+    total_tokens = cumulative_tokens[i - 1] if i else 0
     actual_tokens_per_second = total_tokens / elapsed_time if elapsed_time > 0 else 0
     
     # Determine finish reason
@@ -214,13 +285,13 @@ async def stream_response(content: str, model: str, messages: List[Dict[str, str
     print(f"Model: {model}, Target: {tokens_per_second} t/s, Actual: {actual_tokens_per_second:.2f} t/s, Tokens: {total_tokens}, Time: {elapsed_time:.2f}s")
     
     # Final chunk with usage information
-    sent_content = " ".join([c for c in chunks[:i] if c != "__PARAGRAPH_BREAK__"])
+    sent_content = " ".join([c for c in chunks[:i] if c is not _PARA_BREAK])
     usage = calculate_usage(messages, sent_content)
     
     final_data = {
         "id": response_id,
         "object": "chat.completion.chunk",
-        "created": int(time.time()),
+        "created": created,
         "model": model,
         "choices": [{
             "index": 0,
@@ -229,13 +300,13 @@ async def stream_response(content: str, model: str, messages: List[Dict[str, str
         }],
         "usage": usage
     }
-    yield f"data: {json.dumps(final_data)}\n\n"
-    yield "data: [DONE]\n\n"
+    yield _SSE_PREFIX + orjson.dumps(final_data) + _SSE_SUFFIX
+    yield _SSE_DONE
 
 def get_response_content(response_length: str) -> str:
     """Get the appropriate response content based on the requested length"""
     if response_length == "random":
-        response_length = random.choice([k for k in SAMPLE_RESPONSES.keys() if k not in ["auto"]])
+        response_length = random.choice(app_config.SAMPLE_RESPONSE_KEYS)
     
     return SAMPLE_RESPONSES.get(response_length, SAMPLE_RESPONSES.get("medium", ""))
 
@@ -248,11 +319,9 @@ def get_response_content_for_duration(duration_seconds, model, tokens_per_second
         model: Model ID to use for speed calculation
         tokens_per_second: Override for model's token generation speed
     """
-    from app.config import MODEL_CONFIGS, DEFAULT_CONFIG
-    
     # Get the model's tokens per second rate (or use provided override)
     if tokens_per_second is None:
-        model_config = MODEL_CONFIGS.get(model, DEFAULT_CONFIG)
+        model_config = MODEL_CONFIGS.get(model, app_config.DEFAULT_CONFIG)
         tokens_per_second = model_config.tokens_per_second
     
     # Calculate how many tokens should be generated in the given duration
@@ -266,33 +335,26 @@ def get_response_content_for_duration(duration_seconds, model, tokens_per_second
     target_char_length = target_token_count * 4
     
     # Find the closest predefined response or generate a custom one
-    from app.config import SAMPLE_RESPONSES
-    
-    # Check if any standard responses are close to our target
+    # Check the sized responses on either side of our target
+    # Equally close lengths go to the one configured first
+    lengths = app_config.SIZED_RESPONSE_LENGTHS
+    order = app_config.SIZED_RESPONSE_ORDER
     closest_standard_key = None
     closest_diff = float('inf')
+    closest_order = None
     
-    for length, content in SAMPLE_RESPONSES.items():
-        try:
-            if isinstance(length, str) and length != "auto":
-                length_val = int(length)
-                diff = abs(length_val - target_char_length)
-                if diff < closest_diff:
-                    closest_diff = diff
-                    closest_standard_key = length
-        except ValueError:
-            continue
+    i = bisect.bisect_left(lengths, target_char_length)
+    for j in (i - 1, i):
+        if 0 <= j < len(lengths):
+            diff = abs(lengths[j] - target_char_length)
+            if diff < closest_diff or (diff == closest_diff and order[j] < closest_order):
+                closest_diff = diff
+                closest_order = order[j]
+                closest_standard_key = app_config.SIZED_RESPONSE_KEYS[j]
     
     # If we found a close enough standard response (within 20% difference), use it
     if closest_standard_key and closest_diff < (target_char_length * 0.2):
         return SAMPLE_RESPONSES[closest_standard_key]
     
     # Otherwise, generate a custom response of appropriate length
-    import lorem
-    
-    # Generate paragraphs until we reach or exceed the target length
-    content = ""
-    while len(content) < target_char_length:
-        content += lorem.paragraph() + "\n\n"
-    
-    return content.strip()
+    return _lorem_text(target_char_length)
@@ -1,44 +1,68 @@
-import math
+import functools
+from math import log as _log
 from typing import List, Dict
 from app.models import Message
 
-def estimate_speed_from_parameters(params_billions: float) -> float:
-    """
-    Estimate token generation speed based on model parameter size.
-    Larger models generally generate tokens slower.
-    
-    Formula: base_speed * (1 / log(params + 1))^1.5
-    This gives reasonable estimates across parameter scales.
-    """
-    base_speed = 25  # Base tokens per second for a very small model
+def _compute_speed(params_billions: float) -> float:
+    """Evaluate the parameter-based speed formula (see estimate_speed_from_parameters)"""
+    base_speed = 25.0  # Base tokens per second for a very small model
     if params_billions <= 0:
         return base_speed
     
     # Scale down speed as parameters increase
     # Using logarithmic scale to reflect diminishing impact of parameter count
-    speed = base_speed * (1 / math.log(params_billions + 1)) ** 1.5
+    speed = base_speed * (1 / _log(params_billions + 1)) ** 1.5
     
     # Keep speed within reasonable bounds
     return max(1.0, min(20.0, speed))
 
+# Speeds for whole-billion parameter sizes, which covers almost every model
+_SPEED_TABLE = {p: _compute_speed(p) for p in range(0, 1001)}
+# Other sizes are computed once and cached
+_compute_speed_cached = functools.lru_cache(maxsize=256)(_compute_speed)
+
+def estimate_speed_from_parameters(params_billions: float) -> float:
+    """
+    Estimate token generation speed based on model parameter size.
+    Larger models generally generate tokens slower.
+    
+    Formula: base_speed * (1 / log(params + 1))^1.5
+    This gives reasonable estimates across parameter scales.
+    Whole sizes from 0 to 1000B are served from a precomputed table.
+    """
+    # Integral floats hash like ints, so 7.0 finds the entry for 7
+    speed = _SPEED_TABLE.get(params_billions)
+    if speed is None:
+        speed = _compute_speed_cached(params_billions)
+    return speed
+
+def _tokens_for_length(n: int) -> int:
+    """Estimate tokens from a character count: about 4 characters per token, at least 1 for non-empty text"""
+    return (1 if n < 4 else n >> 2) if n else 0
+
 def estimate_token_count(text: str) -> int:
     """
     Estimate the number of tokens in a text.
     This is a simple approximation - about 4 characters per token for English.
     """
-    if not text:
-        return 0
-    # Count characters and divide by 4 (rough approximation for English text)
-    return max(1, int(len(text) / 4))
+    return _tokens_for_length(len(text))
+
+def estimate_token_counts(texts: List[str]) -> List[int]:
+    """
+    Estimate the number of tokens for a batch of texts.
+    Gives the same result as calling estimate_token_count on each text.
+    """
+    return [_tokens_for_length(length) for length in map(len, texts)]
 
-def calculate_usage(prompt_messages: List[Dict[str, str]], completion_text: str) -> Dict[str, int]:
+def calculate_usage(prompt_messages: List[Message], completion_text: str) -> Dict[str, int]:
     """
     Calculate token usage statistics for the request and response.
     """
-    # Extract content from each message dictionary
-    prompt_text = " ".join([msg.get("content", "") for msg in prompt_messages])
-    prompt_tokens = estimate_token_count(prompt_text)
-    completion_tokens = estimate_token_count(completion_text)
+    # Length of the messages joined with spaces, without building the string
+    n = len(prompt_messages)
+    prompt_chars = sum(len(msg.content) for msg in prompt_messages) + (n - 1) if n else 0
+    prompt_tokens = _tokens_for_length(prompt_chars)
+    completion_tokens = _tokens_for_length(len(completion_text))
     
     return {
         "prompt_tokens": prompt_tokens,
@@ -46,7 +70,7 @@ def calculate_usage(prompt_messages: List[Dict[str, str]], completion_text: str)
         "total_tokens": prompt_tokens + completion_tokens
     }
 
-def calculate_content_length_for_duration(model_speed_tokens_per_second, duration_seconds):
+def calculate_content_length_for_duration(model_speed_tokens_per_second: float, duration_seconds: float) -> int:
     """
     Calculate the appropriate content length (in tokens) for a given duration.
     
@@ -60,7 +84,7 @@ def calculate_content_length_for_duration(model_speed_tokens_per_second, duratio
     # Calculate tokens needed for the duration
     return int(model_speed_tokens_per_second * duration_seconds)
 
-def tokens_to_chars(tokens):
+def tokens_to_chars(tokens: int) -> int:
     """Convert token count to approximate character count"""
     # Simple approximation: ~4 characters per token
     return tokens * 4
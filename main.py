@@ -1,32 +1,16 @@
-from fastapi import FastAPI
 import uvicorn
-from app.api import router, add_cors_middleware, add_cors_headers_middleware
+from app import app
 from app.config import init_config
 
-app = FastAPI(
-    title="OpenAI Stream Mocker",
-    description="A service that mocks OpenAI streaming responses for testing",
-    version="1.0.0"
-)
-
-# Add CORS middleware
-add_cors_middleware(app)
-
-# Add middleware to add CORS headers to all responses
-add_cors_headers_middleware(app)
-
-# Include the API router
-app.include_router(router)
-
-# Initialize configuration at startup
-@app.on_event("startup")
-async def startup_event():
-    """Initialize configuration when the application starts"""
-    init_config()
-    print("Configuration initialized")
+# Initialize configuration at import time; it is a synchronous file load,
+# so the app is ready before the server starts accepting requests
+init_config()
+print("Configuration initialized")
 
 if __name__ == "__main__":
-    # Start the server
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Start the server. "auto" picks uvloop and httptools when they are
+    # installed (uvicorn[standard]); per-request access logging is disabled
+    # since it adds formatting and I/O to every streamed request
+    uvicorn.run(app, host="0.0.0.0", port=8000, loop="auto", http="auto", access_log=False)
     
     print("OpenAI Stream Mocker started at http://localhost:8000")
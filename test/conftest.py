@@ -1,33 +1,52 @@
 import pytest
 import sys
 import os
-import asyncio
 
 # Add the project root to Python path for imports
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+from fastapi.testclient import TestClient
+from app import app
 from app.models import Message, ModelConfig
 from app.config import init_config
 
+# Tests that stream in real time to measure speed or time limits
+_SLOW_TEST_PREFIXES = (
+    "test_stream_speed_", "test_consistency_of_speed", "test_time_limit_enforced",
+    "test_model_speed_update",
+)
+
+def pytest_collection_modifyitems(config, items):
+    """Mark real-time streaming tests as slow so they can be deselected"""
+    for item in items:
+        if item.name.startswith(_SLOW_TEST_PREFIXES):
+            item.add_marker(pytest.mark.slow)
+
 @pytest.fixture(scope="session", autouse=True)
 def initialize_config():
     """Initialize the app configuration for testing"""
     init_config()
 
-@pytest.fixture
+@pytest.fixture(scope="session")
+def client():
+    """Return a test client shared by all API tests"""
+    with TestClient(app) as c:
+        yield c
+
+@pytest.fixture(scope="session")
 def sample_message():
     """Return a simple test message"""
     return Message(role="user", content="Test message")
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def sample_messages():
-    """Return a list of sample messages"""
-    return [
+    """Return a tuple of sample messages, shared read-only across tests"""
+    return (
         Message(role="system", content="You are a helpful assistant."),
         Message(role="user", content="Tell me a story about a robot.")
-    ]
+    )
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def fast_model_config():
     """Return a model config for a fast model"""
     return ModelConfig(
@@ -36,7 +55,7 @@ def fast_model_config():
         parameters=5
     )
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def slow_model_config():
     """Return a model config for a slow model"""
     return ModelConfig(
@@ -45,7 +64,7 @@ def slow_model_config():
         parameters=100
     )
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def medium_model_config():
     """Return a model config for a medium speed model"""
     return ModelConfig(
@@ -54,22 +73,15 @@ def medium_model_config():
         parameters=20
     )
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def short_text():
     """Return a short text for testing"""
     return "This is a short test message for streaming."
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def medium_text():
     """Return a medium-length text for testing"""
     return """This is a medium-length test message for streaming.
     It contains multiple sentences and should produce several chunks 
     when processed by the streaming function. The goal is to test
     the token generation speed accurately."""
-
-@pytest.fixture
-def event_loop():
-    """Create an instance of the default event loop for each test case"""
-    loop = asyncio.get_event_loop_policy().new_event_loop()
-    yield loop
-    loop.close()
@@ -1,13 +1,11 @@
 import pytest
 import time
-import json
+import orjson
 import asyncio
-from fastapi.testclient import TestClient
-from app import app
 
-client = TestClient(app)
+import app.config as app_config
 
-def test_streaming_endpoint():
+def test_streaming_endpoint(client):
     """Test that the streaming endpoint returns the expected format"""
     # Prepare a request to the streaming API
     request_data = {
@@ -31,14 +29,13 @@ def test_streaming_endpoint():
     chunks = []
     content = ""
     
-    for line in response.iter_lines():
+    # The TestClient has already read the whole stream, so split the body once
+    for line in response.text.splitlines():
         if line:
-            # Remove b' prefix and ' suffix from bytes and decode
-            line_text = line.decode('utf-8')
-            chunks.append(line_text)
+            chunks.append(line)
             
-            if line_text.startswith("data: {"):
-                data = json.loads(line_text[6:])  # Skip the "data: " prefix
+            if line.startswith("data: {"):
+                data = orjson.loads(line[6:])  # Skip the "data: " prefix
                 if "choices" in data and data["choices"] and "delta" in data["choices"][0]:
                     delta = data["choices"][0]["delta"]
                     if "content" in delta:
@@ -58,7 +55,7 @@ def test_streaming_endpoint():
     # Check that the last chunk includes usage information
     for i in range(len(chunks) - 2, -1, -1):
         if chunks[i].startswith("data: {"):
-            last_data = json.loads(chunks[i][6:])
+            last_data = orjson.loads(chunks[i][6:])
             if "usage" in last_data:
                 usage = last_data["usage"]
                 assert "prompt_tokens" in usage
@@ -66,7 +63,7 @@ def test_streaming_endpoint():
                 assert "total_tokens" in usage
                 break
 
-def test_model_speed_update():
+def test_model_speed_update(client):
     """Test that updating a model's speed affects the streaming rate"""
     model_name = "test-speed-update-model"
     
@@ -91,7 +88,8 @@ def test_model_speed_update():
     response1 = client.post("/v1/chat/completions", json=request_data)
     
     # Consume response to completion
-    chunks = list(response1.iter_lines())
+    for _ in response1.iter_bytes(chunk_size=65536):
+        pass
     elapsed_time1 = time.time() - start_time
     
     # Update model speed to be much faster
@@ -105,8 +103,65 @@ def test_model_speed_update():
     response2 = client.post("/v1/chat/completions", json=request_data)
     
     # Consume response to completion
-    chunks = list(response2.iter_lines())
+    for _ in response2.iter_bytes(chunk_size=65536):
+        pass
     elapsed_time2 = time.time() - start_time
     
     # The second response should be significantly faster
     assert elapsed_time1 > elapsed_time2 * 1.5
+
+def test_cors_headers(client):
+    """Test that preflight requests are answered and responses carry CORS headers"""
+    response = client.options("/v1/chat/completions")
+    assert response.status_code == 204
+    assert response.headers["access-control-allow-origin"] == "*"
+    assert "POST" in response.headers["access-control-allow-methods"]
+    assert response.headers["access-control-max-age"] == "86400"
+    
+    response = client.get("/")
+    assert response.status_code == 200
+    assert response.headers["access-control-allow-origin"] == "*"
+    assert "Content-Type" in response.headers["access-control-allow-headers"]
+    assert "access-control-max-age" not in response.headers
+
+def test_config_update_refreshes_cached_responses(client):
+    """Test that cached model and config payloads pick up configuration changes"""
+    model_name = "test-cache-refresh-model"
+    
+    # Fill the caches before changing the configuration
+    client.get("/v1/models")
+    client.get("/config")
+    
+    client.post("/config", json={"model": model_name, "tokens_per_second": 200})
+    
+    model_ids = [model["id"] for model in client.get("/v1/models").json()["data"]]
+    assert model_name in model_ids
+    assert client.get("/config").json()["models"][model_name]["tokens_per_second"] == 200
+    
+    response = client.post("/v1/chat/completions", json={
+        "model": model_name,
+        "messages": [{"role": "user", "content": "Hi"}],
+    })
+    assert response.status_code == 200
+    assert response.json()["model"] == model_name
+
+def test_default_speed_update_only_changes_default(client):
+    """Test that a bare tokens_per_second update only changes the default config"""
+    before = client.get("/config").json()
+    old_default = before["default"]["tokens_per_second"]
+    
+    try:
+        client.post("/config", json={"tokens_per_second": old_default + 1})
+        after = client.get("/config").json()
+        assert after["default"]["tokens_per_second"] == old_default + 1
+        assert after["models"] == before["models"]
+    finally:
+        client.post("/config", json={"tokens_per_second": old_default})
+
+def test_config_update_without_changes_keeps_caches(client):
+    """Test that a config request that changes nothing leaves the config version alone"""
+    version = app_config.CONFIG_VERSION
+    
+    response = client.post("/config", json={"description": "nothing to update"})
+    assert response.json() == {"message": "No changes made"}
+    assert app_config.CONFIG_VERSION == version
@@ -1,7 +1,11 @@
 import pytest
 import os
 import tempfile
-from app.config import load_config, init_config, reload_config
+import app.config as app_config
+from app.config import (
+    load_config, init_config, reload_config, bump_config_version,
+    get_auto_response_length,
+)
 from app.models import ModelConfig
 
 def test_load_config():
@@ -39,6 +43,31 @@ content = "This is a test response."
         # Clean up
         os.unlink(tmp_path)
 
+def test_load_config_reuses_unchanged_file():
+    """Test that an unchanged config file is only parsed once"""
+    with tempfile.NamedTemporaryFile(mode='wb', suffix='.toml', delete=False) as tmp:
+        tmp.write(b"""
+[general]
+default_tokens_per_second = 15
+""")
+        tmp_path = tmp.name
+
+    try:
+        first = load_config(tmp_path)
+        assert load_config(tmp_path) is first
+        
+        # Changing the file invalidates the cached result
+        with open(tmp_path, 'wb') as f:
+            f.write(b"""
+[general]
+default_tokens_per_second = 30
+""")
+        second = load_config(tmp_path)
+        assert second is not first
+        assert second["general"]["default_tokens_per_second"] == 30
+    finally:
+        os.unlink(tmp_path)
+
 def test_init_and_reload_config():
     """Test initializing and reloading configuration"""
     # This test relies on the actual config file, but we can verify it works properly
@@ -61,3 +90,38 @@ def test_init_and_reload_config():
     # Verify reload result
     assert "models" in reload_result
     assert "default" in reload_result
+
+def test_config_version_changes_on_update():
+    """Test that configuration changes bump the config version"""
+    version = app_config.CONFIG_VERSION
+    bump_config_version()
+    assert app_config.CONFIG_VERSION == version + 1
+    
+    # Reloading the configuration also invalidates derived caches
+    reload_config()
+    assert app_config.CONFIG_VERSION == version + 2
+
+def test_get_auto_response_length():
+    """Test that model speed maps to the highest threshold it reaches"""
+    init_config()
+    categories = sorted(
+        app_config.AUTO_RESPONSE_LENGTH_CONFIG.values(),
+        key=lambda x: x['max_tokens_per_second'],
+    )
+    for category in categories:
+        threshold = category['max_tokens_per_second']
+        if threshold != float('inf'):
+            assert get_auto_response_length(threshold) == category['response_length']
+    
+    # Speeds below every threshold fall back to medium
+    assert get_auto_response_length(categories[0]['max_tokens_per_second'] - 1) == "medium"
+
+def test_model_config_is_immutable():
+    """Test that model configs are replaced rather than edited in place"""
+    model_config = ModelConfig(tokens_per_second=10)
+    with pytest.raises(Exception):
+        model_config.tokens_per_second = 20
+    
+    updated = model_config.model_copy(update={"tokens_per_second": 20})
+    assert updated.tokens_per_second == 20
+    assert model_config.tokens_per_second == 10
@@ -1,5 +1,8 @@
 import pytest
-from app.utils import estimate_token_count, calculate_usage, estimate_speed_from_parameters
+from app.utils import (
+    estimate_token_count, estimate_token_counts, calculate_usage,
+    estimate_speed_from_parameters
+)
 from app.models import Message
 
 def test_estimate_token_count():
@@ -19,6 +22,13 @@ def test_estimate_token_count():
     text = "This is exactly twenty chars"  # 24 chars
     assert 5 <= estimate_token_count(text) <= 7  # Should be about 6 tokens
 
+def test_estimate_token_counts():
+    """Test that batch token counting matches the single-text function"""
+    texts = ["", "Hi", "Hello world", "This is a much longer sentence with more tokens."]
+    
+    assert estimate_token_counts(texts) == [estimate_token_count(text) for text in texts]
+    assert estimate_token_counts([]) == []
+
 def test_calculate_usage():
     """Test the usage calculation function"""
     messages = [
@@ -35,6 +45,10 @@ def test_calculate_usage():
     assert usage["total_tokens"] == usage["prompt_tokens"] + usage["completion_tokens"]
     assert usage["prompt_tokens"] > 0
     assert usage["completion_tokens"] > 0
+    
+    # Prompt tokens are estimated from the messages joined with spaces
+    assert usage["prompt_tokens"] == estimate_token_count(" ".join(msg.content for msg in messages))
+    assert calculate_usage([], "") == {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
 
 def test_estimate_speed_from_parameters():
     """Test the parameter-based speed estimation function"""
@@ -49,6 +63,11 @@ def test_estimate_speed_from_parameters():
     
     assert small > medium > large > xlarge
     
+    # Speed never increases with size, across table and computed sizes
+    sizes = (1, 3, 7, 7.5, 13, 20, 40, 70, 100, 170, 400, 1500)
+    speeds = [estimate_speed_from_parameters(p) for p in sizes]
+    assert speeds == sorted(speeds, reverse=True)
+    
     # Check a specific value for consistency
     speed_7b = estimate_speed_from_parameters(7)
     # The value should be consistent between runs